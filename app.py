@@ -3,12 +3,12 @@
 # ==============================================================================
 import streamlit as st
 import pandas as pd
-from openai import OpenAI
 
-from utils.conn_Gsheet import conexion_gsheet_produccion, abrir_hoja, cargar_datos
+from utils.conn_Gsheet import conexion_gsheet_produccion, abrir_hoja
+from utils.hogares import cargar_configuracion_hogares, seleccionar_hogar, cargar_indice_hogar, cargar_periodo_hogar, invalidar_datos_hogar, vigilar_version_hogar
 from utils.add_informacion import ingresar_gasto, eliminar_gasto, editar_gasto
 from utils.func_dash import aplicar_filtros, mostrar_metricas_clave, graficar_distribucion_categoria, graficar_evolucion_temporal, graficar_comparativa_persona, graficar_detalle_subcategoria, mostrar_tabla_detallada
-from utils.func_ai import inicializar_cliente_ia, sugerir_categoria_ia, generar_resumen_ia,generar_insights_proactivos, responder_pregunta_financiera
+from utils.func_ai import inicializar_cliente_ia, sugerir_categoria_ia, generar_resumen_ia,generar_insights_proactivos, responder_pregunta_financiera, comprimir_turno, obtener_uso_tokens
 
 
 
@@ -17,23 +17,43 @@ from utils.func_ai import inicializar_cliente_ia, sugerir_categoria_ia, generar_
 # ==============================================================================
 st.set_page_config(page_title="Gestor de Finanzas", layout="wide", initial_sidebar_state="expanded")
 
-# Definir constantes globales para ser usadas en toda la app
-PERSONAS = ["Milagros Valladolid", "Jose Longa"]
-CATEGORIAS = ["Comida", "Hogar", "Transporte", "Ocio", "Salud", "Ropa y Calzado", "Tecnología", "Regalos", "Educación", "Deuda", "Otro"]
-TIPOS_GASTO = ["Fijo Mensual", "Variable Diario", "Ocasional", "Ahorro/Inversión", "Deuda"]
+# --- Hogar de la sesión ---
+# Una misma instancia atiende a varios hogares; cada uno tiene su libro y su
+# configuración en los secretos (ver utils/hogares.py).
+hogares = cargar_configuracion_hogares()
+hogar = seleccionar_hogar(hogares)
+if hogar is None:
+    st.info("Introduce el código y la clave de acceso de tu hogar en la barra lateral para continuar.")
+    st.stop()
+
+# Si la sesión cambia de hogar, el chat y la sugerencia del anterior ya no aplican
+if st.session_state.get("hogar_activo") != hogar["id"]:
+    st.session_state.hogar_activo = hogar["id"]
+    st.session_state.pop("messages", None)
+    st.session_state.pop("sugerencia_categoria", None)
+
+# Constantes del hogar para ser usadas en toda la app
+PERSONAS = hogar["personas"]
+CATEGORIAS = hogar["categorias"]
+TIPOS_GASTO = hogar["tipos_gasto"]
 
 # ==============================================================================
 # 3. INICIALIZACIÓN DE CLIENTES Y CONEXIONES
 # ==============================================================================
 
-ia_model = inicializar_cliente_ia()
+# El cliente de IA no se crea aquí: cada sección que lo necesita llama a
+# inicializar_cliente_ia(), que está cacheada por proceso. Así el primer
+# widget aparece sin esperar a que cargue la librería de Gemini.
 
-# --- Conexión a Google Sheets ---
+# --- Conexión a Google Sheets (cliente compartido por todos los hogares) ---
 client_gsheet = conexion_gsheet_produccion()
 if client_gsheet is None:
     st.error("No se pudo conectar a Google Sheets. La aplicación no puede continuar.")
     st.stop()
-worksheet = abrir_hoja(client_gsheet)
+worksheet = abrir_hoja(client_gsheet, hogar["hoja_calculo"], hogar["pestana"])
+if worksheet is None:
+    st.error(f"No se pudo abrir la hoja '{hogar['hoja_calculo']}' del hogar {hogar['nombre']}.")
+    st.stop()
 #=================================================================
 # 4. CUERPO PRINCIPAL DE LA APLICACIÓN
 # ==============================================================================
@@ -41,6 +61,8 @@ worksheet = abrir_hoja(client_gsheet)
 # --- TÍTULO ---
 st.title("Nuestro Gestor de Finanzas Familiares 📊")
 st.markdown("Una herramienta para registrar y analizar nuestros gastos diarios.")
+if len(hogares) > 1:
+    st.caption(f"Hogar: {hogar['nombre']}")
 
 # --- FORMULARIO DE INGRESO DE GASTOS ---
 with st.expander("➕ Añadir un nuevo gasto", expanded=True):
@@ -56,6 +78,7 @@ with st.expander("➕ Añadir un nuevo gasto", expanded=True):
 
         # Botón para sugerencia de IA
         if st.form_submit_button("🤖 Sugerir Categoría con IA"):
+            ia_model = inicializar_cliente_ia()
             if descripcion_gasto and ia_model:
                 with st.spinner("Pensando... 🤔"):
                     sugerencia = sugerir_categoria_ia(descripcion_gasto, CATEGORIAS, ia_model)
@@ -87,6 +110,7 @@ if submitted_add:
                                     categoria_gasto, subcategoria_gasto, tipo_gasto_seleccionado, notas_gasto)
     if exito:
         st.success(mensaje)
+        invalidar_datos_hogar(hogar["id"], solo_anadido=True)
         if 'sugerencia_categoria' in st.session_state:
             del st.session_state.sugerencia_categoria
         st.rerun()
@@ -98,21 +122,26 @@ if submitted_add:
 st.markdown("---")
 st.header("Análisis y Visualización de Gastos 📈")
 
-df_original = cargar_datos(worksheet)
-if df_original.empty:
+# Para los filtros basta con las columnas Fecha, Persona y Categoria de todos los gastos
+indice = cargar_indice_hogar(hogar["id"], worksheet)
+# Redibuja la sesión cuando otra persona (u otra pestaña) cambie los gastos del hogar
+vigilar_version_hogar(hogar["id"])
+if indice.empty:
     st.info("Aún no hay datos para mostrar. ¡Agrega tu primer gasto para comenzar!")
     st.stop()
 
 # --- Filtros en la barra lateral ---
 st.sidebar.header("Filtros del Dashboard")
-persona_sel = st.sidebar.selectbox("Filtrar por Persona:", ["Ambos"] + list(df_original['Persona'].unique()))
+persona_sel = st.sidebar.selectbox("Filtrar por Persona:", ["Ambos"] + list(indice['Persona'].unique()))
 fecha_sel = st.sidebar.date_input("Filtrar por Rango de Fechas:",
-    value=(df_original['Fecha'].min().date(), df_original['Fecha'].max().date()),
-    min_value=df_original['Fecha'].min().date(), max_value=df_original['Fecha'].max().date())
+    value=(indice['Fecha'].min().date(), indice['Fecha'].max().date()),
+    min_value=indice['Fecha'].min().date(), max_value=indice['Fecha'].max().date())
 categoria_sel = st.sidebar.multiselect("Filtrar por Categoría:",
-    options=["Todas"] + list(df_original['Categoria'].unique()), default="Todas")
+    options=["Todas"] + list(indice['Categoria'].unique()), default="Todas")
 
-df_filtrado = aplicar_filtros(df_original, persona_sel, fecha_sel, categoria_sel)
+# Solo se leen los gastos del rango de fechas elegido
+df_periodo = cargar_periodo_hogar(hogar["id"], worksheet, fecha_sel)
+df_filtrado = aplicar_filtros(df_periodo, persona_sel, fecha_sel, categoria_sel)
 
 # --- Layout del Dashboard ---
 if df_filtrado.empty:
@@ -127,6 +156,7 @@ else:
     
     # Llamamos a nuestra nueva función de IA con los datos filtrados
     with st.spinner("Buscando patrones interesantes en tus gastos..."):
+        ia_model = inicializar_cliente_ia()
         insights = generar_insights_proactivos(df_filtrado, ia_model)
     
     if insights:
@@ -192,18 +222,19 @@ else:
                         datos_actualizados = {'Fecha': nueva_fecha.strftime('%Y-%m-%d'), 'Monto': nuevo_monto, 'Descripcion': nueva_descripcion,
                                               'Categoria': nueva_categoria, 'Subcategoria': nueva_subcategoria, 'Persona': nueva_persona}
                         exito, mensaje = editar_gasto(worksheet, id_gasto, datos_actualizados)
-                        if exito: st.success(mensaje); st.rerun()
+                        if exito: st.success(mensaje); invalidar_datos_hogar(hogar["id"]); st.rerun()
                         else: st.error(mensaje)
                     
                     if submitted_delete:
                         exito, mensaje = eliminar_gasto(worksheet, id_gasto)
-                        if exito: st.success(mensaje); st.rerun()
+                        if exito: st.success(mensaje); invalidar_datos_hogar(hogar["id"]); st.rerun()
                         else: st.error(mensaje)
     
     with tabs[4]:
         st.header("Asistente Financiero con IA")
         st.info("Obtén un análisis y consejos sobre tus gastos para el período seleccionado.")
         
+        ia_model = inicializar_cliente_ia()
         if not ia_model:
             st.warning("La funcionalidad de IA no está disponible. Revisa tu API Key de Google.")
         else:
@@ -212,6 +243,11 @@ else:
                     resumen = generar_resumen_ia(df_filtrado, ia_model)
                     with st.container(border=True):
                         st.markdown(resumen)
+
+            uso_tokens = obtener_uso_tokens()
+            if uso_tokens:
+                with st.expander("Tokens de entrada por llamada"):
+                    st.dataframe(pd.DataFrame(uso_tokens).iloc[::-1], hide_index=True, use_container_width=True)
     
     # ==========================================================
     # <<<<<<<<<<<<<<<    NUEVA PESTAÑA DE CHAT    >>>>>>>>>>>>>>>>>
@@ -228,6 +264,8 @@ else:
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
+                if message.get("tokens_prompt"):
+                    st.caption(f"Tokens de entrada: {message['tokens_prompt']}")
 
         # Aceptar la entrada del usuario
         if prompt := st.chat_input("Ej: ¿Cuál fue el gasto total en Comida?"):
@@ -239,9 +277,18 @@ else:
             # Generar y mostrar la respuesta del asistente
             with st.chat_message("assistant"):
                 with st.spinner("Consultando al analista financiero..."):
-                    # Llamamos a nuestra nueva y potente función de IA
-                    respuesta = responder_pregunta_financiera(prompt, df_filtrado, ia_model)
+                    ia_model = inicializar_cliente_ia()
+                    # Llamamos a nuestra nueva y potente función de IA, con el historial previo
+                    respuesta = responder_pregunta_financiera(prompt, df_filtrado, ia_model,
+                                                              historial=st.session_state.messages[:-1])
+                    tokens_prompt = st.session_state.get("tokens_ultima_pregunta", 0)
                     st.markdown(respuesta)
+                    if tokens_prompt:
+                        st.caption(f"Tokens de entrada: {tokens_prompt}")
             
-            # Añadir la respuesta del asistente al historial
-            st.session_state.messages.append({"role": "assistant", "content": respuesta})
\ No newline at end of file
+            # Añadir la respuesta del asistente al historial; solo las respuestas reales
+            # de la IA (no los avisos de error) se guardan como memoria comprimida
+            mensaje = {"role": "assistant", "content": respuesta, "tokens_prompt": tokens_prompt}
+            if st.session_state.get("respuesta_valida"):
+                mensaje["memoria"] = comprimir_turno(prompt, respuesta)
+            st.session_state.messages.append(mensaje)
\ No newline at end of file
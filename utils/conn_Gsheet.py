@@ -3,26 +3,33 @@ from oauth2client.service_account import ServiceAccountCredentials
 import pandas as pd
 import streamlit as st
 
-def conexion_gsheet_produccion():
+@st.cache_resource(show_spinner=False)
+def _crear_cliente_gsheet():
     """
-    Establece conexión con Google Sheets usando los Secretos de Streamlit.
-    Esta función está diseñada para ser usada exclusivamente en un entorno
-    desplegado en Streamlit Community Cloud.
+    Crea el cliente de gspread una sola vez por proceso. Todas las sesiones
+    y todos los hogares comparten este cliente (y su sesión HTTP).
+    Lanza excepción si falla, para que los errores no queden cacheados.
     """
     # 1. Definir el alcance de los permisos
     scope = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/spreadsheets',
              "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
 
+    # 2. Cargar las credenciales directamente desde los secretos de Streamlit
+    # st.secrets es un diccionario especial que contiene lo que configuraste en la nube.
+    creds_dict = st.secrets["gcp_service_account"]
+
+    # 3. Autorizar usando el diccionario de credenciales
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    return gspread.authorize(creds)
+
+def conexion_gsheet_produccion():
+    """
+    Establece conexión con Google Sheets usando los Secretos de Streamlit.
+    Esta función está diseñada para ser usada exclusivamente en un entorno
+    desplegado en Streamlit Community Cloud.
+    """
     try:
-        # 2. Cargar las credenciales directamente desde los secretos de Streamlit
-        # st.secrets es un diccionario especial que contiene lo que configuraste en la nube.
-        creds_dict = st.secrets["gcp_service_account"]
-        
-        # 3. Autorizar usando el diccionario de credenciales
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        
-        return client
+        return _crear_cliente_gsheet()
         
     except KeyError:
         # Este error ocurre si la sección [gcp_service_account] no está en los secretos.
@@ -34,17 +41,21 @@ def conexion_gsheet_produccion():
         st.error(f"No se pudo conectar a Google Sheets. Error inesperado: {e}")
         return None
 
-def abrir_hoja(client):
+@st.cache_resource(show_spinner=False)
+def _abrir_hoja_cacheada(_client, nombre_hoja, nombre_pestana):
+    """Abre la pestaña una sola vez por proceso y por hogar (el cliente no se usa como clave)."""
+    spreadsheet = _client.open(nombre_hoja)
+    return spreadsheet.worksheet(nombre_pestana)
+
+def abrir_hoja(client, nombre_hoja="FinanzasFamiliares", nombre_pestana="Hoja 1"):
     """
     Abre una hoja de cálculo específica y devuelve el objeto de la hoja.
-    Asegúrate de que el nombre de la hoja sea correcto.
+    Cada hogar indica su propio libro (`nombre_hoja`) y pestaña (`nombre_pestana`).
     """
     try:
-        spreadsheet = client.open("FinanzasFamiliares")
-        worksheet = spreadsheet.worksheet("Hoja 1")
-        return worksheet
+        return _abrir_hoja_cacheada(client, nombre_hoja, nombre_pestana)
     except Exception as e:
-        print(f"Error al abrir la hoja: {e}")
+        print(f"Error al abrir la hoja '{nombre_hoja}' / '{nombre_pestana}': {e}")
         return None
 
 def cargar_datos(worksheet):
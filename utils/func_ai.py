@@ -1,12 +1,19 @@
+from collections import deque
+
 import streamlit as st
-import google.generativeai as genai
 import pandas as pd
 
 # --- NUEVA FUNCIÓN PARA INICIALIZAR EL CLIENTE ---
+@st.cache_resource(show_spinner=False)
 def inicializar_cliente_ia():
-    """Inicializa el cliente de Google Gemini si la clave existe."""
+    """
+    Inicializa el cliente de Google Gemini si la clave existe.
+    El cliente se crea una sola vez por proceso (st.cache_resource) y la
+    librería de Gemini se importa aquí para no pagar su carga en el arranque.
+    """
     try:
         api_key = st.secrets.google_ai.api_key
+        import google.generativeai as genai
         genai.configure(api_key=api_key)
         # Seleccionamos el modelo que vamos a usar
         model = genai.GenerativeModel('gemini-1.5-flash')
@@ -14,19 +21,118 @@ def inicializar_cliente_ia():
     except (AttributeError, KeyError):
         # Si st.secrets.google_ai.api_key no existe
         return None
+    except ImportError as e:
+        st.write(f"La librería de Google Gemini no está instalada: {e}")
+        return None
     except Exception as e:
         st.write(f"Error al configurar la API de Google Gemini: {e}")
         return None
     
+# --- CONSTRUCCIÓN DE PROMPTS CON PRESUPUESTO DE TOKENS ---
+# Estimación rápida sin llamar a la API: ~4 caracteres por token en español.
+CARACTERES_POR_TOKEN = 4
+PRESUPUESTO_TOKENS = 2000          # Máximo de tokens de entrada por llamada
+FRACCION_HISTORIAL = 0.25          # Parte del presupuesto reservada para la conversación previa
+MAX_TOKENS_POR_TURNO = 80          # Memoria comprimida de cada turno del chat
+MAX_TOKENS_PREGUNTA = 200          # Texto libre del usuario (pregunta del chat, descripción de un gasto)
+MAX_TOKENS_ESQUEMA = 150           # Lista de columnas y de tipos de datos del DataFrame
+MAX_FILAS_RESULTADO = 10           # Filas principales que se muestran al resumir una tabla
+MAX_LLAMADAS_REGISTRADAS = 50      # Llamadas que se guardan en st.session_state.uso_tokens
+
+def estimar_tokens(texto):
+    """Estima los tokens de un texto sin llamar a la API."""
+    return -(-len(texto) // CARACTERES_POR_TOKEN)
+
+def recortar_a_tokens(texto, max_tokens):
+    """Recorta un texto para que no supere `max_tokens` (estimados)."""
+    max_caracteres = max(0, max_tokens) * CARACTERES_POR_TOKEN
+    if len(texto) <= max_caracteres:
+        return texto
+    return texto[:max(0, max_caracteres - 15)].rstrip() + " …(recortado)"
+
+def resumir_resultado(resultado, max_tokens):
+    """
+    Convierte el resultado de un cálculo en un texto compacto para el prompt.
+    Las tablas se envían completas si caben en `max_tokens`; si no, se
+    reducen a su tamaño, estadísticas básicas y las filas principales
+    (top-N por la primera columna numérica).
+    """
+    if isinstance(resultado, pd.Series):
+        resultado = resultado.to_frame(name=resultado.name if resultado.name is not None else "valor")
+    if not isinstance(resultado, pd.DataFrame):
+        return recortar_a_tokens(str(resultado), max_tokens)
+
+    # Cada fila ocupa al menos un token: con más filas que tokens ni se intenta
+    if len(resultado) <= max_tokens:
+        texto = resultado.to_string()
+        if estimar_tokens(texto) <= max_tokens:
+            return texto
+
+    partes = [f"Tabla de {len(resultado)} filas y {len(resultado.columns)} columnas: {', '.join(map(str, resultado.columns))}."]
+    numericas = resultado.select_dtypes(include="number")
+    if not numericas.empty:
+        estadisticas = numericas.agg(["sum", "mean", "min", "max"]).round(2)
+        partes.append("Estadísticas:\n" + estadisticas.to_string())
+        principales = resultado.nlargest(MAX_FILAS_RESULTADO, numericas.columns[0])
+        partes.append(f"Top {len(principales)} por '{numericas.columns[0]}':\n" + principales.to_string())
+    else:
+        partes.append(f"Primeras {MAX_FILAS_RESULTADO} filas:\n" + resultado.head(MAX_FILAS_RESULTADO).to_string())
+    return recortar_a_tokens("\n".join(partes), max_tokens)
+
+def comprimir_turno(pregunta, respuesta):
+    """Memoria compacta de un turno del chat, guardada junto al mensaje en st.session_state.messages."""
+    return recortar_a_tokens(f"Usuario: {pregunta}\nAsistente: {respuesta}", MAX_TOKENS_POR_TURNO)
+
+def resumir_historial(mensajes, max_tokens):
+    """
+    Construye el contexto de la conversación a partir de la memoria
+    comprimida de cada turno, de la más reciente a la más antigua, hasta
+    agotar `max_tokens`. Los turnos que no caben se descartan.
+    """
+    turnos = []
+    usados = 0
+    for mensaje in reversed(mensajes or []):
+        memoria = mensaje.get("memoria")
+        if mensaje.get("role") != "assistant" or not memoria:
+            continue
+        costo = estimar_tokens(memoria) + 1
+        if usados + costo > max_tokens:
+            break
+        turnos.append(memoria)
+        usados += costo
+    return "\n".join(reversed(turnos))
+
+def _generar(model, prompt, etiqueta):
+    """
+    Llama a Gemini y devuelve (response, tokens_de_entrada): los tokens que
+    informa la API o, si no los devuelve, la estimación. La llamada queda
+    registrada en st.session_state.uso_tokens (solo las últimas
+    MAX_LLAMADAS_REGISTRADAS). Lanza ValueError, sin llamar a la API, si el
+    prompt supera PRESUPUESTO_TOKENS.
+    """
+    estimados = estimar_tokens(prompt)
+    if estimados > PRESUPUESTO_TOKENS:
+        raise ValueError(f"el prompt (~{estimados} tokens) supera el presupuesto de {PRESUPUESTO_TOKENS} tokens")
+    response = model.generate_content(prompt)
+    reales = getattr(getattr(response, "usage_metadata", None), "prompt_token_count", None)
+    registro = st.session_state.setdefault("uso_tokens", deque(maxlen=MAX_LLAMADAS_REGISTRADAS))
+    registro.append({"llamada": etiqueta, "estimados": estimados, "reales": reales})
+    return response, (reales if reales is not None else estimados)
+
+def obtener_uso_tokens():
+    """Devuelve el registro de tokens de entrada de las últimas llamadas de esta sesión."""
+    return list(st.session_state.get("uso_tokens", []))
+
 # --- FUNCIONES DE IA ACTUALIZADAS ---
 def sugerir_categoria_ia(descripcion, categorias_posibles, model):
     """Usa Gemini para sugerir una categoría."""
     if not model:
         return None
 
+    descripcion = recortar_a_tokens(descripcion, MAX_TOKENS_PREGUNTA)
     prompt = f"""Dada la descripción de un gasto: "{descripcion}", ¿cuál de estas categorías es la más apropiada? Categorías disponibles: {', '.join(categorias_posibles)}. Responde únicamente con el nombre exacto de la categoría. Si ninguna encaja, responde 'Otro'."""
     try:
-        response = model.generate_content(prompt)
+        response, _ = _generar(model, prompt, "sugerir_categoria")
         sugerencia = response.text.strip()
         return sugerencia if sugerencia in categorias_posibles else "Otro"
     except Exception as e:
@@ -46,6 +152,7 @@ def generar_resumen_ia(df_filtrado, model):
     gastos_por_categoria = df_filtrado.groupby('Categoria')['Monto'].sum().sort_values(ascending=False)
     categoria_mayor_gasto = gastos_por_categoria.index[0]
     monto_mayor_gasto = gastos_por_categoria.iloc[0]
+    desglose = resumir_resultado(gastos_por_categoria, PRESUPUESTO_TOKENS // 2)
 
     # 2. Construir el prompt para la IA
     prompt = f"""
@@ -54,7 +161,7 @@ def generar_resumen_ia(df_filtrado, model):
     - Gasto Total: ${gasto_total:,.2f}
     - La categoría con el mayor gasto fue '{categoria_mayor_gasto}' con un total de ${monto_mayor_gasto:,.2f}.
     - Desglose de gastos por categoría:
-    {gastos_por_categoria.to_string()}
+    {desglose}
 
     Basado en esta información, escribe un breve resumen financiero (máximo 3 párrafos). Tu resumen debe incluir:
     1. Un punto positivo o un logro evidente en sus finanzas.
@@ -64,7 +171,7 @@ def generar_resumen_ia(df_filtrado, model):
     Usa un tono positivo, motivador y evita el lenguaje técnico. Dirígete a ellos como "ustedes".
     """
     try:
-        response = model.generate_content(prompt)
+        response, _ = _generar(model, prompt, "resumen")
         return response.text
     except Exception as e:
         st.write(f"Error al llamar a la API de Gemini para generar resumen: {e}")
@@ -105,7 +212,7 @@ def generar_insights_proactivos(df, ia_model):
     promedio_gasto = df['Monto'].mean()
     # Si el gasto más caro es 5 veces más grande que el promedio, es un insight interesante.
     if gasto_mas_caro['Monto'] > promedio_gasto * 5:
-        insights_preparados.append(f"Se detectó un gasto significativamente grande de ${gasto_mas_caro['Monto']:,.2f} en '{gasto_mas_caro['Descripcion']}' en la categoría '{gasto_mas_caro['Categoria']}'.")
+        insights_preparados.append(f"Se detectó un gasto significativamente grande de ${gasto_mas_caro['Monto']:,.2f} en '{recortar_a_tokens(str(gasto_mas_caro['Descripcion']), MAX_TOKENS_POR_TURNO)}' en la categoría '{gasto_mas_caro['Categoria']}'.")
         
     # --- Ahora, pasamos estos insights a la IA para que los reformule ---
     if not insights_preparados:
@@ -129,7 +236,7 @@ def generar_insights_proactivos(df, ia_model):
     """
     
     try:
-        response = ia_model.generate_content(prompt)
+        response, _ = _generar(ia_model, prompt, "insights")
         # Dividimos la respuesta de la IA en una lista de insights
         insights_finales = [line.strip() for line in response.text.strip().split('\n') if line.strip()]
         return insights_finales
@@ -137,26 +244,40 @@ def generar_insights_proactivos(df, ia_model):
         st.write(f"Error al generar insights proactivos con IA: {e}")
         return ["Ocurrió un error al analizar las tendencias."]
 
-def responder_pregunta_financiera(pregunta_usuario, df, ia_model):
+def responder_pregunta_financiera(pregunta_usuario, df, ia_model, historial=None):
     """
     Procesa una pregunta en lenguaje natural, la convierte a código pandas,
     la ejecuta y devuelve una respuesta en lenguaje natural.
+    `historial` son los mensajes previos del chat (st.session_state.messages);
+    se usa su memoria comprimida para entender preguntas de seguimiento.
+    Los tokens de entrada de sus llamadas se dejan en
+    st.session_state.tokens_ultima_pregunta, y st.session_state.respuesta_valida
+    indica si la respuesta viene de la IA (y no es un aviso de error) para
+    guardarla como memoria del chat.
     """
+    st.session_state.tokens_ultima_pregunta = 0
+    st.session_state.respuesta_valida = False
     if not ia_model: return "La funcionalidad de IA no está disponible."
     if df.empty: return "No hay datos disponibles para responder preguntas."
 
+    pregunta_usuario = recortar_a_tokens(pregunta_usuario, MAX_TOKENS_PREGUNTA)
+
     # Preparamos información sobre el DataFrame para darle contexto a la IA
-    columnas = df.columns.tolist()
-    tipos_de_datos = df.dtypes.to_string()
+    columnas = recortar_a_tokens(str(df.columns.tolist()), MAX_TOKENS_ESQUEMA)
+    tipos_de_datos = recortar_a_tokens(df.dtypes.to_string(), MAX_TOKENS_ESQUEMA)
+    contexto_previo = resumir_historial(historial, int(PRESUPUESTO_TOKENS * FRACCION_HISTORIAL))
+    if contexto_previo:
+        contexto_previo = f"Conversación previa (úsala solo para entender referencias como 'y el mes anterior?'):\n{contexto_previo}\n"
     
     # --- PASO 1: Generar el código Pandas ---
     prompt_generar_codigo = f"""
     Actúa como un experto en Python y la librería Pandas. Tu tarea es convertir una pregunta del usuario en código Pandas ejecutable.
     
-    El DataFrame se llama `df` y tiene las siguientes columnas: {df.columns.tolist()}
+    El DataFrame se llama `df` y tiene las siguientes columnas: {columnas}
     Los tipos de datos de las columnas son:
-    {df.dtypes.to_string()}
+    {tipos_de_datos}
     
+    {contexto_previo}
     La pregunta del usuario es: "{pregunta_usuario}"
     
     Escribe el código de Python Pandas que calcule la respuesta.
@@ -166,7 +287,8 @@ def responder_pregunta_financiera(pregunta_usuario, df, ia_model):
     """
     
     try:
-        response_codigo = ia_model.generate_content(prompt_generar_codigo)
+        response_codigo, tokens = _generar(ia_model, prompt_generar_codigo, "chat_codigo")
+        st.session_state.tokens_ultima_pregunta += tokens
         codigo_generado = response_codigo.text.strip()
     except Exception as e:
         st.write(f"Error al generar código: {e}")
@@ -195,11 +317,13 @@ def responder_pregunta_financiera(pregunta_usuario, df, ia_model):
         return f"No pude procesar tu solicitud. Parece que la pregunta generó un cálculo inválido."
 
     # --- PASO 3: Interpretar el resultado y generar respuesta final ---
-    prompt_interpretar_resultado = f"""
-    Eres un asistente financiero amigable. Un usuario hizo la siguiente pregunta: "{pregunta_usuario}"
-    
+    # El resultado puede ser una tabla enorme: se resume para que el prompt
+    # completo quepa en el presupuesto de tokens.
+    plantilla_interpretar = """
+    Eres un asistente financiero amigable. Un usuario hizo la siguiente pregunta: "{pregunta}"
+    {contexto}
     Para responder, se ejecutó un cálculo que dio el siguiente resultado:
-    {str(resultado_ejecucion)}
+    {resultado}
     
     Tu tarea es presentar este resultado al usuario de una manera clara, concisa y en lenguaje natural.
     - Si el resultado es un número, formatéalo como moneda si es apropiado.
@@ -207,10 +331,17 @@ def responder_pregunta_financiera(pregunta_usuario, df, ia_model):
     - Si es un error, explícalo de forma sencilla.
     - Sé breve y directo en tu respuesta.
     """
+    tokens_fijos = estimar_tokens(plantilla_interpretar.format(pregunta=pregunta_usuario, contexto=contexto_previo, resultado=""))
+    resultado_compacto = resumir_resultado(resultado_ejecucion, PRESUPUESTO_TOKENS - tokens_fijos)
+    prompt_interpretar_resultado = plantilla_interpretar.format(pregunta=pregunta_usuario, contexto=contexto_previo,
+                                                                resultado=resultado_compacto)
     
     try:
-        response_final = ia_model.generate_content(prompt_interpretar_resultado)
-        return response_final.text.strip()
+        response_final, tokens = _generar(ia_model, prompt_interpretar_resultado, "chat_respuesta")
+        st.session_state.tokens_ultima_pregunta += tokens
+        respuesta = response_final.text.strip()
+        st.session_state.respuesta_valida = True
+        return respuesta
     except Exception as e:
         st.write(f"Error al interpretar resultado: {e}")
-        return f"El resultado del cálculo fue: {str(resultado_ejecucion)}, pero tuve problemas para explicarlo."
\ No newline at end of file
+        return f"El resultado del cálculo fue: {resultado_compacto}, pero tuve problemas para explicarlo."
\ No newline at end of file
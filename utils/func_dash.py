@@ -1,6 +1,8 @@
 import pandas as pd
 import streamlit as st
-import plotly.express as px
+
+# plotly.express se importa dentro de cada gráfico: es una dependencia pesada
+# y solo se necesita cuando el gráfico se dibuja realmente.
 
 def aplicar_filtros(df, persona, fechas, categorias):
     """Filtra el DataFrame según las selecciones del usuario."""
@@ -40,6 +42,7 @@ def graficar_distribucion_categoria(df):
     gastos_por_categoria = df.groupby('Categoria')['Monto'].sum().sort_values(ascending=False)
     
     if not gastos_por_categoria.empty:
+        import plotly.express as px
         fig = px.pie(
             gastos_por_categoria, 
             values=gastos_por_categoria.values, 
@@ -56,6 +59,7 @@ def graficar_evolucion_temporal(df):
     gastos_diarios = df.groupby(df['Fecha'].dt.date)['Monto'].sum()
     
     if not gastos_diarios.empty:
+        import plotly.express as px
         fig = px.line(
             gastos_diarios, 
             x=gastos_diarios.index, 
@@ -74,6 +78,7 @@ def graficar_comparativa_persona(df):
     gastos_por_persona = df.groupby('Persona')['Monto'].sum().sort_values(ascending=False)
     
     if not gastos_por_persona.empty:
+        import plotly.express as px
         fig = px.bar(
             gastos_por_persona, 
             x=gastos_por_persona.index, 
@@ -94,6 +99,7 @@ def graficar_detalle_subcategoria(df):
     df_subcat = df[df['Subcategoria'].notna() & (df['Subcategoria'] != '')].copy()
 
     if not df_subcat.empty:
+        import plotly.express as px
         gastos_por_subcat = df_subcat.groupby(['Categoria', 'Subcategoria'])['Monto'].sum().reset_index()
         fig = px.treemap(
             gastos_por_subcat,
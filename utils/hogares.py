@@ -0,0 +1,392 @@
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+from utils.snapshots import snapshots_disponibles, actualizar_snapshot, leer_snapshot, leer_hoja, revisar_snapshot, descartar_snapshot
+from utils.sincronizacion import asegurar_sincronizacion
+
+# Valores por defecto: los que usaba la app cuando atendía a una sola familia.
+# El libro y las personas solo se aplican al hogar implícito "principal" (sin
+# sección [hogares]); la pestaña, las categorías y los tipos de gasto, a todos.
+HOJA_CALCULO_POR_DEFECTO = "FinanzasFamiliares"
+PESTANA_POR_DEFECTO = "Hoja 1"
+PERSONAS_POR_DEFECTO = ["Milagros Valladolid", "Jose Longa"]
+CATEGORIAS_POR_DEFECTO = ["Comida", "Hogar", "Transporte", "Ocio", "Salud", "Ropa y Calzado", "Tecnología", "Regalos", "Educación", "Deuda", "Otro"]
+TIPOS_GASTO_POR_DEFECTO = ["Fijo Mensual", "Variable Diario", "Ocasional", "Ahorro/Inversión", "Deuda"]
+
+LIMITE_MEMORIA_MB_POR_DEFECTO = 256
+INACTIVIDAD_MAXIMA_SEG_POR_DEFECTO = 30 * 60
+VIGENCIA_DATOS_SEG_POR_DEFECTO = 60
+INTERVALO_AVISO_SESIONES_SEG = 5  # Cada sesión compara su versión en memoria; no lee Google Sheets
+
+# Columnas que lee la app: las del índice alimentan los filtros de la barra
+# lateral; las del período, el dashboard, la gestión y la IA.
+COLUMNAS_INDICE = ["Fecha", "Persona", "Categoria"]
+COLUMNAS_APP = ["ID_Gasto", "Fecha", "Monto", "Descripcion", "Persona", "Categoria", "Subcategoria"]
+
+
+@st.cache_resource(show_spinner=False)
+def cargar_configuracion_hogares():
+    """
+    Lee y valida (una sola vez por proceso) la configuración de los hogares
+    desde los Secretos de Streamlit.
+
+    Cada hogar se define en una sección [hogares.<id>] con las claves
+    `nombre`, `hoja_calculo`, `pestana`, `personas`, `categorias`,
+    `tipos_gasto` y `clave`. `hoja_calculo` y `personas` son obligatorias,
+    y `clave` también cuando hay varios hogares: un hogar al que le falten
+    se descarta (y se avisa en el log), para que nunca abra el libro de
+    otra familia ni se entre sin clave. Si no existe la sección [hogares],
+    se devuelve un único hogar "principal" con los valores por defecto, de
+    modo que los despliegues de una sola familia siguen igual.
+
+    Returns:
+        dict: {id_hogar: dict con la configuración completa del hogar}
+    """
+    try:
+        secciones = dict(st.secrets["hogares"])
+        implicito = False
+    except (KeyError, FileNotFoundError):
+        secciones = {"principal": {"hoja_calculo": HOJA_CALCULO_POR_DEFECTO, "personas": PERSONAS_POR_DEFECTO}}
+        implicito = True
+
+    hogares = {}
+    for id_hogar, datos in secciones.items():
+        datos = dict(datos)
+        faltan = [clave for clave in ("hoja_calculo", "personas") if not datos.get(clave)]
+        if len(secciones) > 1 and not datos.get("clave"):
+            faltan.append("clave")
+        if faltan and not implicito:
+            print(f"El hogar '{id_hogar}' se ignora: le falta {', '.join(faltan)} en [hogares.{id_hogar}].")
+            continue
+        hogares[id_hogar] = {
+            "id": id_hogar,
+            "nombre": datos.get("nombre", id_hogar),
+            "hoja_calculo": datos["hoja_calculo"],
+            "pestana": datos.get("pestana", PESTANA_POR_DEFECTO),
+            "personas": list(datos["personas"]),
+            "categorias": list(datos.get("categorias", CATEGORIAS_POR_DEFECTO)),
+            "tipos_gasto": list(datos.get("tipos_gasto", TIPOS_GASTO_POR_DEFECTO)),
+            "clave": datos.get("clave"),
+        }
+    return hogares
+
+
+def seleccionar_hogar(hogares):
+    """
+    Determina el hogar de la sesión actual y comprueba su clave.
+
+    Con un solo hogar se usa directamente (si tiene `clave`, se pide igual).
+    Con varios hogares la `clave` es obligatoria en todos: el código del
+    hogar se escribe en la barra lateral (`?hogar=<id>` en la URL solo lo
+    rellena, y se puede corregir) y nunca se muestran los nombres de los
+    demás hogares. Un código inexistente y una clave incorrecta dan el
+    mismo mensaje.
+
+    Returns:
+        dict | None: La configuración del hogar, o None si aún no hay acceso.
+    """
+    if not hogares:
+        st.error("No hay ningún hogar configurado correctamente. Revisa la sección [hogares] de los secretos.")
+        return None
+    if len(hogares) == 1:
+        id_hogar = next(iter(hogares))
+    else:
+        id_hogar = st.sidebar.text_input("Código del hogar:", value=st.query_params.get("hogar", "")).strip()
+        if not id_hogar:
+            return None
+
+    hogar = hogares.get(id_hogar)
+    accesos = st.session_state.setdefault("hogares_autorizados", set())
+    if hogar is not None and id_hogar in accesos:
+        return hogar
+    if hogar is not None and not hogar["clave"]:
+        # Solo llega aquí el hogar único: con varios, la clave es obligatoria al cargar la configuración
+        return hogar
+
+    clave = st.sidebar.text_input("Clave de acceso:", type="password")
+    if not clave:
+        return None
+    if hogar is None or not hmac.compare_digest(clave.encode("utf-8"), str(hogar["clave"]).encode("utf-8")):
+        st.sidebar.error("Código de hogar o clave incorrectos.")
+        return None
+    accesos.add(id_hogar)
+    return hogar
+
+
+class CacheLibrosHogares:
+    """
+    Caché en memoria de los DataFrames de gastos de cada hogar.
+
+    Es compartida por todas las sesiones del proceso. Cada entrada es una
+    vista de un hogar, con clave (id_hogar, vista...): el índice de la barra
+    lateral o un período con sus columnas. El tamaño total (memory_usage
+    profundo de pandas) se limita a un presupuesto global; cuando se supera,
+    se descartan primero las vistas usadas hace más tiempo (LRU). También se
+    descartan las vistas sin actividad durante más de `inactividad_maxima_seg`,
+    y las que tienen más de `vigencia_seg` se vuelven a leer, salvo las de
+    los hogares cuyo hilo de sincronización está en marcha y al día
+    (marcar_sincronizado): ese hilo ya avisa de cada cambio.
+
+    Cada hogar tiene además una versión: un contador que sube cada vez que
+    se publica una huella de contenido distinta (ver snapshots.py, que la
+    calcula igual con o sin instantáneas). Al subir se descartan sus vistas,
+    y las sesiones comparan la versión con la suya para saber si deben
+    volver a dibujarse, sin leer nada de Google Sheets.
+    """
+
+    def __init__(self, limite_bytes, inactividad_maxima_seg, vigencia_seg):
+        self.limite_bytes = limite_bytes
+        self.inactividad_maxima_seg = inactividad_maxima_seg
+        self.vigencia_seg = vigencia_seg
+        self._entradas = OrderedDict()  # (id_hogar, vista...) -> (df, bytes, cargado_en, ultimo_acceso)
+        self._versiones = {}  # id_hogar -> (creado, huella, versión)
+        self._accesos = {}  # id_hogar -> último acceso de alguna sesión
+        self._sincronizados = set()  # hogares con un hilo de sincronización al día
+        self._bytes_totales = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        """Devuelve el DataFrame cacheado de la vista o None si no está."""
+        with self._lock:
+            self._descartar_inactivos()
+            self._accesos[clave[0]] = time.monotonic()
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            df, tamano, cargado_en, _ = entrada
+            ahora = time.monotonic()
+            if clave[0] not in self._sincronizados and ahora - cargado_en > self.vigencia_seg:
+                self._quitar(clave)
+                return None
+            self._entradas[clave] = (df, tamano, cargado_en, ahora)
+            self._entradas.move_to_end(clave)
+            return df
+
+    def guardar(self, clave, df, huella):
+        """
+        Guarda la vista y libera memoria si hace falta. Si `huella` ya no es
+        la vigente del hogar, los datos están desfasados y no se guardan.
+        """
+        tamano = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if self._huella(clave[0]) != huella:
+                return
+            self._quitar(clave)
+            ahora = time.monotonic()
+            self._entradas[clave] = (df, tamano, ahora, ahora)
+            self._bytes_totales += tamano
+            # Nunca se descarta la vista recién guardada, aunque por sí sola supere el límite
+            while self._bytes_totales > self.limite_bytes and len(self._entradas) > 1:
+                clave_mas_antigua = next(iter(self._entradas))
+                self._quitar(clave_mas_antigua)
+
+    def publicar_version(self, id_hogar, huella, creado):
+        """
+        Anuncia la huella de los datos del hogar, leídos en el momento
+        `creado`. Si la huella no cambia, o se leyó antes que la vigente, no
+        hace nada; si cambia, sube la versión y descarta las vistas del
+        hogar, lo que avisa a las sesiones abiertas.
+
+        Returns:
+            bool: True si la versión cambió.
+        """
+        with self._lock:
+            actual = self._versiones.get(id_hogar)
+            if actual is not None and (actual[1] == huella or creado < actual[0]):
+                return False
+            version = 1 if actual is None else actual[2] + 1
+            self._versiones[id_hogar] = (creado, huella, version)
+            self._quitar_hogar(id_hogar)
+            return True
+
+    def marcar_sincronizado(self, id_hogar, activo):
+        """
+        Lo llama el hilo de sincronización del hogar: mientras sus vueltas
+        terminan bien, las vistas del hogar no caducan por tiempo.
+        """
+        with self._lock:
+            if activo:
+                self._sincronizados.add(id_hogar)
+            else:
+                self._sincronizados.discard(id_hogar)
+
+    def invalidar(self, id_hogar):
+        """Elimina las vistas del hogar (p. ej. tras ingresar, editar o eliminar un gasto)."""
+        with self._lock:
+            self._quitar_hogar(id_hogar)
+
+    def version(self, id_hogar):
+        """Versión vigente de los datos del hogar (None si aún no hay)."""
+        with self._lock:
+            actual = self._versiones.get(id_hogar)
+            return None if actual is None else actual[2]
+
+    def huella(self, id_hogar):
+        """Huella del contenido de la versión vigente (None si aún no hay)."""
+        with self._lock:
+            return self._huella(id_hogar)
+
+    def contiene(self, id_hogar):
+        """
+        Indica si alguna sesión usó el hogar en los últimos
+        `inactividad_maxima_seg`, sin contarlo como un acceso. No depende de
+        que queden vistas: publicar una versión nueva las descarta todas.
+        """
+        with self._lock:
+            acceso = self._accesos.get(id_hogar)
+            return acceso is not None and time.monotonic() - acceso <= self.inactividad_maxima_seg
+
+    def _huella(self, id_hogar):
+        actual = self._versiones.get(id_hogar)
+        return None if actual is None else actual[1]
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._bytes_totales -= entrada[1]
+
+    def _quitar_hogar(self, id_hogar):
+        for clave in [c for c in self._entradas if c[0] == id_hogar]:
+            self._quitar(clave)
+
+    def _descartar_inactivos(self):
+        limite = time.monotonic() - self.inactividad_maxima_seg
+        for clave in [c for c, (_, _, _, acceso) in self._entradas.items() if acceso < limite]:
+            self._quitar(clave)
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_cache_libros():
+    """Crea (una sola vez por proceso) la caché de gastos compartida por todos los hogares."""
+    try:
+        config = dict(st.secrets["cache_hogares"])
+    except (KeyError, FileNotFoundError):
+        config = {}
+    limite_mb = config.get("limite_memoria_mb", LIMITE_MEMORIA_MB_POR_DEFECTO)
+    inactividad = config.get("inactividad_maxima_seg", INACTIVIDAD_MAXIMA_SEG_POR_DEFECTO)
+    vigencia = config.get("vigencia_datos_seg", VIGENCIA_DATOS_SEG_POR_DEFECTO)
+    return CacheLibrosHogares(int(limite_mb * 1024 * 1024), inactividad, vigencia)
+
+
+def _recortar(df, columnas, fecha_desde, fecha_hasta):
+    """Versión en pandas de la lectura podada, para cuando no hay instantáneas."""
+    if df.empty:
+        return df
+    if fecha_desde is not None:
+        df = df[df['Fecha'] >= pd.Timestamp(fecha_desde)]
+    if fecha_hasta is not None:
+        df = df[df['Fecha'] <= pd.Timestamp(fecha_hasta)]
+    return df[[c for c in columnas if c in df.columns]]
+
+
+def _leer_vista(id_hogar, worksheet, cache, columnas, fecha_desde, fecha_hasta):
+    """
+    Lee una vista del hogar, publica su huella y devuelve (df, huella).
+
+    Con instantáneas, primero se deja al día la instantánea (sin lecturas de
+    Sheets si la hoja no cambió) y luego se leen solo las columnas y grupos de
+    filas del período. Sin ellas, o si la instantánea va por detrás de la
+    versión ya publicada, se lee la hoja completa una vez, se guarda en la
+    caché y se recorta en pandas.
+    """
+    if snapshots_disponibles():
+        try:
+            actualizar_snapshot(id_hogar, worksheet)
+            resultado = leer_snapshot(id_hogar, columnas, fecha_desde, fecha_hasta)
+            if resultado is not None:
+                df, huella, creado = resultado
+                cache.publicar_version(id_hogar, huella, creado)
+                if cache.huella(id_hogar) == huella:
+                    asegurar_sincronizacion(id_hogar, worksheet, cache)
+                    return df, huella
+        except Exception as e:
+            # Ante cualquier problema con la instantánea, la hoja sigue siendo la fuente de verdad
+            print(f"Error con la instantánea del hogar {id_hogar}, se usa la carga completa: {e}")
+
+    clave_completo = (id_hogar, "completo")
+    completo = cache.obtener(clave_completo)
+    if completo is not None:
+        # Publicar una versión descarta las vistas: la cacheada es la vigente
+        huella = cache.huella(id_hogar)
+    else:
+        completo, huella, creado = leer_hoja(worksheet)
+        cache.publicar_version(id_hogar, huella, creado)
+        cache.guardar(clave_completo, completo, huella)
+    return _recortar(completo, columnas, fecha_desde, fecha_hasta), huella
+
+
+def _cargar_vista(id_hogar, worksheet, vista, columnas, fecha_desde=None, fecha_hasta=None):
+    """
+    Devuelve (df, versión) de una vista, desde la caché o leyéndola. La
+    versión es siempre la vigente de la caché, para que la sesión no se
+    redibuje sin fin si sus datos no llegaron a publicarse.
+    """
+    cache = obtener_cache_libros()
+    clave = (id_hogar,) + vista
+    df = cache.obtener(clave)
+    if df is None:
+        df, huella = _leer_vista(id_hogar, worksheet, cache, columnas, fecha_desde, fecha_hasta)
+        cache.guardar(clave, df, huella)
+    return df, cache.version(id_hogar)
+
+
+def cargar_indice_hogar(id_hogar, worksheet):
+    """
+    Devuelve las columnas de los filtros (Fecha, Persona, Categoria) de todos
+    los gastos del hogar y anota su versión en st.session_state.version_datos.
+    Con las instantáneas, el resto de columnas ni se leen del disco.
+    """
+    df, version = _cargar_vista(id_hogar, worksheet, ("indice",), COLUMNAS_INDICE)
+    st.session_state.version_datos = version
+    return df
+
+
+def cargar_periodo_hogar(id_hogar, worksheet, fechas):
+    """
+    Devuelve los gastos del hogar en el rango de fechas de la barra lateral,
+    solo con las columnas que usa la app. Las fechas se pasan a la lectura de
+    la instantánea, que se salta los grupos de filas fuera del rango.
+    """
+    fecha_desde, fecha_hasta = (fechas[0], fechas[1]) if len(fechas) == 2 else (None, None)
+    df, version = _cargar_vista(id_hogar, worksheet, ("periodo", fecha_desde, fecha_hasta),
+                                COLUMNAS_APP, fecha_desde, fecha_hasta)
+    if version != st.session_state.get("version_datos"):
+        # Los datos cambiaron entre el índice y el período: la sesión se redibujará
+        st.session_state.version_datos = None
+    return df
+
+
+def version_datos_hogar(id_hogar):
+    """Versión de los datos del hogar; cambia cuando otra sesión o la hoja los modifican."""
+    return obtener_cache_libros().version(id_hogar)
+
+
+def invalidar_datos_hogar(id_hogar, solo_anadido=False):
+    """
+    Descarta las vistas cacheadas del hogar tras escribir en la hoja. Si
+    solo se añadió un gasto (`solo_anadido`), la próxima carga trae la fila
+    nueva como delta; si se editó o borró, la instantánea se descarta y se
+    lee la hoja completa. La nueva versión se publica al recargar, y con
+    ella se avisa a las demás sesiones.
+    """
+    obtener_cache_libros().invalidar(id_hogar)
+    if solo_anadido:
+        revisar_snapshot(id_hogar)
+    else:
+        descartar_snapshot(id_hogar)
+
+
+@st.fragment(run_every=INTERVALO_AVISO_SESIONES_SEG)
+def vigilar_version_hogar(id_hogar):
+    """
+    Fragmento que se reejecuta solo cada pocos segundos y redibuja la app
+    completa si la versión de los datos del hogar cambió desde que esta
+    sesión los cargó (guardada en st.session_state.version_datos).
+    """
+    if version_datos_hogar(id_hogar) != st.session_state.get("version_datos"):
+        st.rerun()
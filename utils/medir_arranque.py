@@ -0,0 +1,119 @@
+"""
+Mide el tiempo de arranque en frío de la aplicación.
+
+Se ejecuta desde la raíz del proyecto:
+
+    python -m utils.medir_arranque --limite 3.0
+
+Cada medición se hace en un proceso nuevo de Python (sin cachés de import):
+se ejecuta app.py completo una vez con streamlit.testing.v1.AppTest, con
+secretos de prueba (incluida una clave de Gemini falsa) y una hoja de Google
+Sheets simulada y vacía, así que no se hace ninguna llamada de red. Se mide
+hasta que el script termina de dibujar la primera pantalla, sin contar la
+importación de streamlit, y se comprueba que las dependencias pesadas
+(Gemini, plotly) NO se carguen en ese primer dibujado. Devuelve código de
+salida 1 si se supera el límite, si el script lanza una excepción o si
+alguna dependencia pesada se cargó de forma anticipada, para poder usarlo
+como control de regresiones.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencias que solo deben cargarse cuando una pestaña o gráfico las usa
+MODULOS_PESADOS = ["google.generativeai", "plotly.express", "openai"]
+
+_CODIGO_MEDICION = """
+import json, os, sys, time
+sys.path.insert(0, {raiz!r})
+os.chdir({raiz!r})
+from streamlit.testing.v1 import AppTest
+
+# Se anotan los intentos de importar dependencias pesadas aunque no estén instaladas
+intentados = set()
+class _Vigia:
+    def find_spec(self, nombre, ruta=None, destino=None):
+        if nombre in {pesados!r}:
+            intentados.add(nombre)
+        return None
+sys.meta_path.insert(0, _Vigia())
+
+inicio = time.perf_counter()
+import utils.conn_Gsheet as conn_gsheet
+
+class _Libro:
+    def get_lastUpdateTime(self):
+        return "2000-01-01T00:00:00.000Z"
+
+class _Hoja:
+    spreadsheet = _Libro()
+    def get_all_values(self):
+        return [["ID_Gasto", "Fecha", "Monto", "Descripcion", "Persona", "Categoria", "Subcategoria", "Tipo de Gasto", "Notas"]]
+    def get_all_records(self):
+        return []
+    def col_values(self, columna):
+        return ["ID_Gasto"]
+
+class _Cliente:
+    def open(self, nombre_hoja):
+        return self
+    def worksheet(self, nombre_pestana):
+        return _Hoja()
+
+# Google Sheets simulado: la app usa el cliente compartido de conn_Gsheet
+conn_gsheet._crear_cliente_gsheet = lambda: _Cliente()
+
+at = AppTest.from_file("app.py", default_timeout=120)
+at.secrets["google_ai"] = {{"api_key": "clave-de-prueba"}}
+at.secrets["snapshots"] = {{"activo": False}}
+at.secrets["sincronizacion"] = {{"activo": False}}
+at.run()
+duracion = time.perf_counter() - inicio
+cargados = sorted(intentados | {{m for m in {pesados!r} if m in sys.modules}})
+errores = [str(e.value) for e in at.exception]
+print(json.dumps({{"segundos": duracion, "pesados_cargados": cargados, "errores": errores}}))
+"""
+
+
+def medir_una_vez():
+    """Ejecuta app.py una vez en un proceso nuevo y devuelve la medición."""
+    codigo = _CODIGO_MEDICION.format(raiz=RAIZ_PROYECTO, pesados=MODULOS_PESADOS)
+    salida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío de la app.")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Número de procesos a medir.")
+    parser.add_argument("--limite", type=float, default=None, help="Tiempo máximo permitido (mediana, en segundos).")
+    args = parser.parse_args()
+
+    mediciones = [medir_una_vez() for _ in range(args.repeticiones)]
+    tiempos = [m["segundos"] for m in mediciones]
+    mediana = statistics.median(tiempos)
+    pesados = sorted({p for m in mediciones for p in m["pesados_cargados"]})
+    errores = sorted({e for m in mediciones for e in m["errores"]})
+
+    print(f"Arranque en frío (mediana de {len(tiempos)}): {mediana:.3f} s  (mín {min(tiempos):.3f} s, máx {max(tiempos):.3f} s)")
+
+    hay_regresion = False
+    if errores:
+        print(f"REGRESIÓN: app.py lanzó excepciones en el primer dibujado: {'; '.join(errores)}")
+        hay_regresion = True
+    if pesados:
+        print(f"REGRESIÓN: dependencias pesadas cargadas al arrancar: {', '.join(pesados)}")
+        hay_regresion = True
+    if args.limite is not None and mediana > args.limite:
+        print(f"REGRESIÓN: el arranque supera el límite de {args.limite:.3f} s")
+        hay_regresion = True
+
+    return 1 if hay_regresion else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import streamlit as st
+
+from utils.snapshots import actualizar_snapshot, modificacion_hoja
+
+INTERVALO_SEG_POR_DEFECTO = 15
+REINTENTO_SIN_SENAL_SEG = 600  # Espera antes de volver a lanzar el hilo si Drive no da la fecha de modificación
+
+
+def configuracion_sincronizacion():
+    """Lee la sección opcional [sincronizacion] de los secretos."""
+    try:
+        config = dict(st.secrets["sincronizacion"])
+    except (KeyError, FileNotFoundError):
+        config = {}
+    return {
+        "activo": config.get("activo", True),
+        "intervalo_seg": config.get("intervalo_seg", INTERVALO_SEG_POR_DEFECTO),
+    }
+
+
+def _vigilar_hogar(id_hogar, worksheet, cache, intervalo_seg, registro):
+    """
+    Bucle del hilo de sincronización de un hogar. En cada vuelta deja al día
+    la instantánea, que compara la fecha de modificación del libro en Drive
+    con la guardada junto a los datos cargados (sin lecturas de Sheets si
+    coinciden), y publica su versión en la caché. La versión es la huella del
+    contenido: si las celdas no cambiaron no se publica nada, y si cambiaron
+    se descartan las vistas y se avisa a todas las sesiones. Mientras las
+    vueltas terminan bien, la caché no hace caducar por tiempo las vistas
+    del hogar.
+
+    Termina cuando ninguna sesión usa el hogar durante el tiempo de
+    inactividad de la caché (la siguiente sesión que lo abra lo vuelve a
+    lanzar) o cuando Drive no devuelve la fecha de modificación: sin esa
+    señal barata cada vuelta leería la hoja completa, así que se avisa una
+    vez en el log y no se relanza hasta pasados REINTENTO_SIN_SENAL_SEG.
+    """
+    try:
+        while True:
+            time.sleep(intervalo_seg)
+            if not cache.contiene(id_hogar):
+                break
+            try:
+                modificado = modificacion_hoja(worksheet)
+                if modificado is None:
+                    with registro["lock"]:
+                        if id_hogar not in registro["sin_senal"]:
+                            print(f"Sincronización del hogar {id_hogar} detenida: Drive no devuelve la fecha de "
+                                  f"modificación del libro (se reintenta en {REINTENTO_SIN_SENAL_SEG} s)")
+                        registro["sin_senal"][id_hogar] = time.monotonic()
+                    break
+                with registro["lock"]:
+                    registro["sin_senal"].pop(id_hogar, None)
+                huella, creado = actualizar_snapshot(id_hogar, worksheet, modificado)
+                cache.publicar_version(id_hogar, huella, creado)
+                cache.marcar_sincronizado(id_hogar, True)
+            except Exception as e:
+                cache.marcar_sincronizado(id_hogar, False)
+                print(f"Error al sincronizar el hogar {id_hogar}: {e}")
+    finally:
+        cache.marcar_sincronizado(id_hogar, False)
+        with registro["lock"]:
+            registro["hilos"].pop(id_hogar, None)
+
+
+@st.cache_resource(show_spinner=False)
+def _obtener_registro():
+    """
+    Hilos de sincronización activos del proceso, uno por hogar, y hogares
+    cuyo libro no da fecha de modificación (con el momento en que se vio).
+    """
+    return {"hilos": {}, "sin_senal": {}, "lock": threading.Lock()}
+
+
+def asegurar_sincronizacion(id_hogar, worksheet, cache):
+    """
+    Lanza el hilo de sincronización del hogar si aún no está en marcha y no
+    se detuvo hace poco por falta de fecha de modificación en Drive.
+    """
+    config = configuracion_sincronizacion()
+    if not config["activo"]:
+        return
+    registro = _obtener_registro()
+    with registro["lock"]:
+        if id_hogar in registro["hilos"]:
+            return
+        sin_senal = registro["sin_senal"].get(id_hogar)
+        if sin_senal is not None and time.monotonic() - sin_senal < REINTENTO_SIN_SENAL_SEG:
+            return
+        hilo = threading.Thread(target=_vigilar_hogar, name=f"sincronizacion-{id_hogar}", daemon=True,
+                                args=(id_hogar, worksheet, cache, config["intervalo_seg"], registro))
+        registro["hilos"][id_hogar] = hilo
+        hilo.start()
@@ -0,0 +1,451 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+# Las instantáneas se guardan en disco local, una carpeta por hogar:
+#   <directorio>/<id_hogar>/base-<sha256>.parquet   (columnar, ordenado por Fecha)
+#   <directorio>/<id_hogar>/delta-<sha256>.parquet  (filas añadidas después, una por lectura)
+#   <directorio>/<id_hogar>/metadatos.json          (archivos con su hash, huella del contenido, fechas)
+DIRECTORIO_POR_DEFECTO = ".snapshots"
+REVISION_COMPLETA_HORAS_POR_DEFECTO = 6
+FILAS_POR_GRUPO = 4096  # Grupos de filas pequeños para poder descartarlos por Fecha al leer
+MAX_DELTAS = 16         # Archivos de filas nuevas que se acumulan antes de compactarlos en la base
+MARGEN_RELOJ_SEG = 2    # Holgura entre el reloj de Google y el local al comparar fechas
+
+COLUMNAS_NUMERICAS = ["Monto"]
+COLUMNA_FECHA = "Fecha"
+COLUMNA_ID = "ID_Gasto"
+MODULO_HUELLA = 2 ** 256
+
+
+def _configuracion():
+    """Lee la sección opcional [snapshots] de los secretos."""
+    try:
+        config = dict(st.secrets["snapshots"])
+    except (KeyError, FileNotFoundError):
+        config = {}
+    return {
+        "activo": config.get("activo", True),
+        "directorio": config.get("directorio", DIRECTORIO_POR_DEFECTO),
+        "revision_completa_horas": config.get("revision_completa_horas", REVISION_COMPLETA_HORAS_POR_DEFECTO),
+    }
+
+
+def snapshots_disponibles():
+    """Indica si se pueden usar instantáneas: activas en los secretos y pyarrow instalado."""
+    if not _configuracion()["activo"]:
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _carpeta(id_hogar):
+    return os.path.join(_configuracion()["directorio"], id_hogar)
+
+
+@st.cache_resource(show_spinner=False)
+def _obtener_locks():
+    """Un lock por hogar, compartido por las sesiones y el hilo de sincronización."""
+    return {"locks": {}, "lock": threading.Lock()}
+
+
+def _lock_hogar(id_hogar):
+    registro = _obtener_locks()
+    with registro["lock"]:
+        return registro["locks"].setdefault(id_hogar, threading.Lock())
+
+
+@st.cache_resource(show_spinner=False)
+def _obtener_verificados():
+    """Archivos Parquet cuyo hash ya se comprobó en este proceso: (ruta, sha256, mtime_ns)."""
+    return set()
+
+
+def modificacion_hoja(worksheet):
+    """
+    Fecha de modificación del libro según Drive (no consume cuota de lectura
+    de Sheets). Devuelve None si no está disponible.
+    """
+    try:
+        return worksheet.spreadsheet.get_lastUpdateTime()
+    except Exception:
+        return None
+
+
+def _segundos_drive(modificado):
+    """Convierte la fecha RFC 3339 de Drive en segundos desde la época, o None."""
+    try:
+        return datetime.fromisoformat(modificado.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def _hash_archivo(ruta):
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def _normalizar_fila(fila):
+    """Quita las celdas vacías del final: la API las omite según el rango pedido."""
+    fila = list(fila)
+    while fila and fila[-1] == "":
+        fila.pop()
+    return fila
+
+
+def _sumar_huella(huella, filas):
+    """
+    Suma a la huella el hash de cada fila con contenido. Al ser una suma, la
+    huella de la hoja completa es la misma tanto si se calcula de una vez
+    como si se va acumulando con las filas nuevas de cada lectura.
+    """
+    total = int(huella, 16)
+    for fila in filas:
+        fila = _normalizar_fila(fila)
+        if fila:
+            total += int(hashlib.sha256(json.dumps(fila, ensure_ascii=False).encode("utf-8")).hexdigest(), 16)
+    return format(total % MODULO_HUELLA, "064x")
+
+
+def _huella_contenido(encabezados, filas):
+    """Huella del contenido de la hoja (encabezados y filas), independiente del orden de las filas."""
+    return _sumar_huella(format(0, "064x"), [encabezados] + list(filas))
+
+
+def _huella_ids(ids):
+    """Huella de la columna ID_Gasto en el orden de la hoja, para reconocer filas solo añadidas."""
+    return hashlib.sha256(json.dumps(ids, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _ids_de(encabezados, filas):
+    if COLUMNA_ID not in encabezados:
+        return None
+    indice = encabezados.index(COLUMNA_ID)
+    return [fila[indice] if len(fila) > indice else "" for fila in filas]
+
+
+def _letra_columna(numero):
+    letras = ""
+    while numero:
+        numero, resto = divmod(numero - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _filas_a_dataframe(encabezados, filas):
+    """
+    Convierte filas crudas de la hoja en un DataFrame con los mismos tipos
+    que cargar_datos. Las columnas de texto se guardan como str para que
+    Parquet tenga un esquema estable (también cuando no hay filas).
+    """
+    filas = [fila + [""] * (len(encabezados) - len(fila)) for fila in filas if any(fila)]
+    df = pd.DataFrame([fila[:len(encabezados)] for fila in filas], columns=encabezados)
+    for columna in df.columns:
+        if columna in COLUMNAS_NUMERICAS:
+            # Siempre float: un delta con montos enteros debe tener el mismo esquema que la base
+            df[columna] = pd.to_numeric(df[columna], errors='coerce').astype("float64")
+        elif columna == COLUMNA_FECHA:
+            df[columna] = pd.to_datetime(df[columna], errors='coerce')
+        else:
+            df[columna] = df[columna].fillna("").astype(str)
+    if COLUMNA_FECHA in df.columns:
+        df.dropna(subset=[COLUMNA_FECHA], inplace=True)
+    return df
+
+
+def leer_hoja(worksheet):
+    """
+    Lee la hoja completa en una sola llamada, sin instantáneas.
+
+    Returns:
+        tuple: (df, huella del contenido, momento de la lectura). La huella
+        es la misma que la de una instantánea con el mismo contenido.
+    """
+    leido = time.time()
+    valores = worksheet.get_all_values()
+    encabezados, filas = (valores[0], valores[1:]) if valores else ([], [])
+    return _filas_a_dataframe(encabezados, filas), _huella_contenido(encabezados, filas), leido
+
+
+def _leer_metadatos(carpeta):
+    try:
+        with open(os.path.join(carpeta, "metadatos.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _escribir_metadatos(carpeta, metadatos):
+    descriptor, ruta_temporal = tempfile.mkstemp(dir=carpeta, suffix=".json.tmp")
+    with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+        json.dump(metadatos, f)
+    os.replace(ruta_temporal, os.path.join(carpeta, "metadatos.json"))
+
+
+def _archivo_valido(carpeta, entrada):
+    """
+    Comprueba un Parquet de la instantánea. Siempre se comparan su tamaño y
+    su fecha de modificación; el hash completo se verifica una sola vez por
+    proceso y archivo, para no leerlo entero antes de cada lectura mapeada.
+    """
+    ruta = os.path.join(carpeta, entrada["archivo"])
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return False
+    if estado.st_size != entrada["bytes"] or estado.st_mtime_ns != entrada["mtime_ns"]:
+        return False
+    verificados = _obtener_verificados()
+    clave = (os.path.abspath(ruta), entrada["sha256"], entrada["mtime_ns"])
+    if clave not in verificados:
+        if _hash_archivo(ruta) != entrada["sha256"]:
+            print(f"La instantánea {ruta} no coincide con su hash; se descarta.")
+            return False
+        verificados.add(clave)
+    return True
+
+
+def _instantanea_valida(carpeta, metadatos):
+    try:
+        return metadatos is not None and all(_archivo_valido(carpeta, e) for e in metadatos["archivos"])
+    except (KeyError, TypeError):
+        # Metadatos de una versión anterior: se vuelve a leer la hoja completa
+        return False
+
+
+def _escribir_parquet(carpeta, df, prefijo):
+    """Escribe un Parquet de forma atómica (archivo temporal + os.replace) y devuelve su entrada."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if COLUMNA_FECHA in df.columns:
+        df = df.sort_values(by=COLUMNA_FECHA, kind="stable")
+    tabla = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+
+    descriptor, ruta_temporal = tempfile.mkstemp(dir=carpeta, suffix=".parquet.tmp")
+    os.close(descriptor)
+    pq.write_table(tabla, ruta_temporal, row_group_size=FILAS_POR_GRUPO)
+    sha = _hash_archivo(ruta_temporal)
+    archivo = f"{prefijo}-{sha[:16]}.parquet"
+    ruta = os.path.join(carpeta, archivo)
+    os.replace(ruta_temporal, ruta)
+    estado = os.stat(ruta)
+    _obtener_verificados().add((os.path.abspath(ruta), sha, estado.st_mtime_ns))
+    return {"archivo": archivo, "sha256": sha, "bytes": estado.st_size, "mtime_ns": estado.st_mtime_ns, "filas": len(df)}
+
+
+def _guardar_metadatos(carpeta, metadatos):
+    """Escribe los metadatos y borra los Parquet a los que ya no apuntan."""
+    _escribir_metadatos(carpeta, metadatos)
+    vigentes = {e["archivo"] for e in metadatos["archivos"]}
+    for nombre in os.listdir(carpeta):
+        if nombre.endswith(".parquet") and nombre not in vigentes:
+            try:
+                os.remove(os.path.join(carpeta, nombre))
+            except OSError:
+                pass
+
+
+def _leer_tabla(carpeta, archivos, columnas=None, filtros=None):
+    """Lee y concatena la base y los deltas con memoria mapeada, aplicando la poda."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tablas = [pq.read_table(os.path.join(carpeta, e["archivo"]), columns=columnas, filters=filtros, memory_map=True)
+              for e in archivos]
+    return pa.concat_tables(tablas, promote_options="default")
+
+
+def _leer_filas_nuevas(worksheet, metadatos):
+    """
+    Lee en una sola llamada los encabezados, la columna ID_Gasto y las filas
+    posteriores a las de la instantánea. Devuelve (filas nuevas, ids) si los
+    encabezados y los IDs ya guardados siguen intactos (solo se añadieron
+    filas), o None si hay que leer la hoja completa.
+    """
+    encabezados = metadatos["encabezados"]
+    if metadatos.get("ids_sha256") is None:
+        return None
+    filas_hoja = metadatos["filas_hoja"]
+    ultima = _letra_columna(len(encabezados))
+    columna_id = _letra_columna(encabezados.index(COLUMNA_ID) + 1)
+    cabecera, ids, filas_nuevas = worksheet.batch_get(
+        [f"A1:{ultima}1", f"{columna_id}2:{columna_id}", f"A{filas_hoja + 2}:{ultima}"])
+
+    if _normalizar_fila(cabecera[0] if cabecera else []) != _normalizar_fila(encabezados):
+        return None
+    ids = [fila[0] if fila else "" for fila in ids]
+    if len(ids) < filas_hoja or _huella_ids(ids[:filas_hoja]) != metadatos["ids_sha256"]:
+        return None
+    return [list(fila) for fila in filas_nuevas], ids
+
+
+def _al_dia(metadatos, modificado):
+    """
+    La instantánea está al día si Drive da la misma fecha de modificación que
+    la última vez, o una anterior a la última lectura (Drive la publicó tarde).
+    """
+    if metadatos.get("pendiente") or modificado is None:
+        return False
+    if modificado == metadatos.get("modificado"):
+        return True
+    segundos = _segundos_drive(modificado)
+    return segundos is not None and segundos < metadatos["leido"] - MARGEN_RELOJ_SEG
+
+
+def _guardar_completa(carpeta, metadatos, encabezados, filas, modificado, leido):
+    """Rehace la instantánea con la hoja completa; si el contenido no cambió, solo los metadatos."""
+    huella = _huella_contenido(encabezados, filas)
+    ids = _ids_de(encabezados, filas)
+    if metadatos is not None and metadatos.get("huella") == huella:
+        archivos, creado = metadatos["archivos"], metadatos["creado"]
+    else:
+        archivos, creado = [_escribir_parquet(carpeta, _filas_a_dataframe(encabezados, filas), "base")], leido
+    _guardar_metadatos(carpeta, {"archivos": archivos, "encabezados": encabezados, "filas_hoja": len(filas),
+                                 "ids_sha256": None if ids is None else _huella_ids(ids), "huella": huella,
+                                 "creado": creado, "leido": leido, "completo_en": leido,
+                                 "modificado": modificado, "pendiente": False})
+    return huella, creado
+
+
+def _guardar_delta(carpeta, metadatos, filas_nuevas, ids, modificado, leido):
+    """Añade las filas nuevas como un delta; si ya hay demasiados, los compacta en una base nueva."""
+    df = _filas_a_dataframe(metadatos["encabezados"], filas_nuevas)
+    archivos = metadatos["archivos"]
+    if len(archivos) > MAX_DELTAS:
+        anteriores = _leer_tabla(carpeta, archivos).to_pandas()
+        archivos = [_escribir_parquet(carpeta, pd.concat([anteriores, df], ignore_index=True), "base")]
+    elif not df.empty:
+        archivos = archivos + [_escribir_parquet(carpeta, df, "delta")]
+
+    filas_hoja = metadatos["filas_hoja"] + len(filas_nuevas)
+    ids = (ids + [""] * filas_hoja)[:filas_hoja]
+    metadatos = dict(metadatos, archivos=archivos, filas_hoja=filas_hoja, ids_sha256=_huella_ids(ids),
+                     huella=_sumar_huella(metadatos["huella"], filas_nuevas), creado=leido, leido=leido,
+                     modificado=modificado, pendiente=False)
+    _guardar_metadatos(carpeta, metadatos)
+    return metadatos["huella"], leido
+
+
+def actualizar_snapshot(id_hogar, worksheet, modificado=None):
+    """
+    Deja al día la instantánea del hogar y devuelve su versión como
+    (huella del contenido, momento de la lectura que la produjo).
+    `modificado` es la fecha de Drive si quien llama ya la leyó (el hilo de
+    sincronización); si es None se lee aquí.
+
+    - Si la fecha de modificación del libro en Drive no cambió desde la
+      última lectura, no se lee nada de Google Sheets.
+    - Si cambió, se leen en una llamada los IDs y las filas posteriores a
+      las guardadas: si los IDs anteriores siguen iguales, solo se añaden
+      las filas nuevas como un delta.
+    - Si no hay filas nuevas (una edición en el sitio), los IDs cambiaron
+      (un borrado) o pasaron `revision_completa_horas` desde la última
+      lectura completa, se lee la hoja completa.
+
+    Limitación: una edición en una fila antigua hecha en Google Sheets a la
+    vez que se añade otra fila no se ve hasta la siguiente lectura completa.
+    Las ediciones y borrados hechos desde la app descartan la instantánea.
+    Las sesiones y el hilo de sincronización se turnan con un lock por hogar.
+    """
+    carpeta = _carpeta(id_hogar)
+    with _lock_hogar(id_hogar):
+        os.makedirs(carpeta, exist_ok=True)
+        metadatos = _leer_metadatos(carpeta)
+        if not _instantanea_valida(carpeta, metadatos):
+            metadatos = None
+        # Red de seguridad para la limitación de arriba
+        revision_vencida = (metadatos is not None and
+                            time.time() - metadatos["completo_en"] > _configuracion()["revision_completa_horas"] * 3600)
+
+        # La fecha se lee antes que los datos: si la hoja cambia entre ambas lecturas,
+        # la próxima comprobación verá una fecha más nueva y volverá a leer.
+        if modificado is None:
+            modificado = modificacion_hoja(worksheet)
+        if metadatos is not None and not revision_vencida and _al_dia(metadatos, modificado):
+            if modificado != metadatos["modificado"]:
+                metadatos["modificado"] = modificado
+                _escribir_metadatos(carpeta, metadatos)
+            return metadatos["huella"], metadatos["creado"]
+
+        leido = time.time()
+        if metadatos is not None and not revision_vencida:
+            nuevas = _leer_filas_nuevas(worksheet, metadatos)
+            if nuevas is not None and any(_normalizar_fila(fila) for fila in nuevas[0]):
+                return _guardar_delta(carpeta, metadatos, nuevas[0], nuevas[1], modificado, leido)
+
+        valores = worksheet.get_all_values()
+        encabezados, filas = (valores[0], valores[1:]) if valores else ([], [])
+        return _guardar_completa(carpeta, metadatos, encabezados, filas, modificado, leido)
+
+
+def leer_snapshot(id_hogar, columnas=None, fecha_desde=None, fecha_hasta=None):
+    """
+    Lee la instantánea de un hogar (base y deltas) con memoria mapeada.
+
+    Solo se leen las `columnas` pedidas (las que no existan en la hoja se
+    ignoran) y, gracias a las estadísticas de cada grupo de filas, se
+    saltan los grupos fuera del rango de fechas.
+
+    Returns:
+        tuple | None: (df, huella del contenido, momento de la lectura que
+        la produjo), o None si no hay una instantánea válida.
+    """
+    carpeta = _carpeta(id_hogar)
+    # Con el lock, ningún escritor borra los archivos entre la comprobación y la apertura
+    with _lock_hogar(id_hogar):
+        metadatos = _leer_metadatos(carpeta)
+        if not _instantanea_valida(carpeta, metadatos):
+            return None
+
+        nombres = metadatos["encabezados"]
+        if columnas is not None:
+            columnas = [c for c in columnas if c in nombres]
+        filtros = []
+        if COLUMNA_FECHA in nombres and fecha_desde is not None:
+            filtros.append((COLUMNA_FECHA, ">=", pd.Timestamp(fecha_desde)))
+        if COLUMNA_FECHA in nombres and fecha_hasta is not None:
+            filtros.append((COLUMNA_FECHA, "<=", pd.Timestamp(fecha_hasta)))
+
+        tabla = _leer_tabla(carpeta, metadatos["archivos"], columnas, filtros or None)
+    return tabla.to_pandas(split_blocks=True, self_destruct=True), metadatos["huella"], metadatos["creado"]
+
+
+def revisar_snapshot(id_hogar):
+    """
+    Obliga a comprobar la hoja en la próxima carga aunque Drive aún no haya
+    reflejado la nueva fecha de modificación. Se usa tras añadir un gasto
+    desde la app: la fila nueva llega como delta, sin releer la hoja.
+    """
+    carpeta = _carpeta(id_hogar)
+    with _lock_hogar(id_hogar):
+        metadatos = _leer_metadatos(carpeta)
+        if metadatos is not None:
+            metadatos["pendiente"] = True
+            _escribir_metadatos(carpeta, metadatos)
+
+
+def descartar_snapshot(id_hogar):
+    """
+    Elimina los metadatos de la instantánea del hogar para forzar una lectura
+    completa. Se usa tras editar o borrar desde la app: el cambio no se
+    puede traer como filas nuevas.
+    """
+    with _lock_hogar(id_hogar):
+        try:
+            os.remove(os.path.join(_carpeta(id_hogar), "metadatos.json"))
+        except OSError:
+            pass